@@ -1,10 +1,11 @@
 import argparse
+import functools
 import math
 import json
 import re
 import sympy
 from sys import argv
-from typing import Optional
+from typing import Iterator, Optional
 from copy import copy
 import textwrap
 
@@ -96,34 +97,41 @@ class GameData:
 
         return copy(lower_bodies[body_name.lower()])
 
+    def get_body_children(self) -> dict[str, list[str]]:
+        body_children: dict[str, list[str]] = {}
+        for body in self.bodies.values():
+            body_children.setdefault(body.parent_body, []).append(body.name)
+
+        for children in body_children.values():
+            children.sort()
+
+        return body_children
+
 
 class ShowOptions(argparse.Action):
-    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
-        argparse.Action.__init__(self, option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None,
+                 metavar=None, game_data: GameData = None):
+        argparse.Action.__init__(self, option_strings=option_strings, dest=dest, default=default, nargs="?",
+                                 metavar=metavar, help=help)
+        self.game_data: Optional[GameData] = game_data
 
     def __call__(self, parser, namespace, values, option_string=None):
-        game_data = read_game_data(GAME_DATA_FILE_PATH)
+        game_data = self.game_data if self.game_data is not None else read_game_data(GAME_DATA_FILE_PATH)
         print("Available celestial bodies:")
-        sorted_body_list: list[tuple[str, CelestialBody]] = \
-            sorted(game_data.bodies.items(), key=lambda x: (x[1].parent_body, x[1].name))
 
-        system_map = {body[1].name: ["", 0, body[1].parent_body] for body in sorted_body_list}
-        for index, part in enumerate(sorted_body_list):
-            new_root = part[1].parent_body
-            indent = "  "
-            while True:
-                if new_root == "":
-                    break
-                system_map[new_root][1] += 1
-                indent += "  "
-                new_root = game_data.bodies[new_root].parent_body
+        # A full body name shows that body and everything orbiting it, anything else is matched as a name prefix
+        if values is not None and game_data.verify_body(values):
+            rows = system_hierarchy_rows(game_data, root_body=game_data.get_celestial_body(values).name)
+        else:
+            rows = system_hierarchy_rows(game_data, name_prefix=values or "")
 
-            system_map[part[1].name][0] = indent
-
-        new_system_map = self.recursive_system_sorter("", 0, len(system_map) - 1, system_map)
-
-        for row in new_system_map:
+        shown_bodies = 0
+        for row in rows:
             print(row)
+            shown_bodies += 1
+
+        if shown_bodies == 0:
+            print(f"  No celestial bodies match \"{values}\"")
 
         print("\nAvailable communication parts:")
         available_comm_part_matrix = [["Full Part Name", "Alias"]]
@@ -137,23 +145,22 @@ class ShowOptions(argparse.Action):
         print(f"\nFor modded items or bodies add them to the {GAME_DATA_FILE_PATH} file")
         parser.exit()
 
-    def recursive_system_sorter(self, parent_body, start_index, end_index, system_map):
-        if start_index > end_index:
-            return []
 
-        new_system_map = ["" for _ in range(start_index, end_index + 1)]
-        current_index = 0
-        for body, data in system_map.items():
-            if data[2] == parent_body:
-                new_system_map[current_index] = data[0] + body
+def system_hierarchy_rows(game_data: GameData, root_body: str = "", name_prefix: str = "") -> Iterator[str]:
+    # Depth first walk of the parent -> children index, each body is indented two spaces per level below the root
+    body_children = game_data.get_body_children()
 
-                for index, body_string in enumerate(
-                        self.recursive_system_sorter(body, current_index + 1, current_index + data[1], system_map)):
-                    new_system_map[current_index + 1 + index] = body_string
+    if root_body == "":
+        stack = [(body, 1) for body in reversed(body_children.get("", []))]
+    else:
+        stack = [(root_body, 1)]
 
-                current_index += data[1] + 1
+    while stack:
+        body, depth = stack.pop()
+        if body.lower().startswith(name_prefix.lower()):
+            yield "  " * depth + body
 
-        return new_system_map
+        stack.extend((child, depth + 1) for child in reversed(body_children.get(body, [])))
 
 
 def read_game_data(file_path: str) -> GameData:
@@ -313,6 +320,34 @@ def calculate_maximum_comm_distance(comm_power_1: int, comm_power_2: int, minimu
     return int(round(max_comm_range * (1 - sol)))
 
 
+@functools.lru_cache(maxsize=None)
+def calculate_signal_strength_root(minimum_strength: float) -> sympy.Float:
+    # The root calculate_maximum_comm_distance uses, solved once for each strength
+    x = sympy.symbols("x")
+    solutions = sympy.solve(sympy.Eq(-2*x**3 + 3*x**2, minimum_strength), x)
+
+    # At 0%, 50% and 100% sympy returns plain real roots instead, take the one between 0 and 1
+    if not solutions[1].is_Add:
+        return next(solution for solution in solutions if 0 <= solution <= 1)
+
+    return solutions[1].args[0]
+
+
+def calculate_maximum_comm_distance_cached(comm_power_1: int, comm_power_2: int, minimum_strength: float) -> int:
+    # Same result as calculate_maximum_comm_distance without solving the cubic on every call, which the fleet audit
+    # needs for large fleets. kspcac_diff_test.py checks the two against each other
+    sol = calculate_signal_strength_root(minimum_strength)
+    max_comm_range = math.sqrt(comm_power_1 * comm_power_2)
+
+    # The float arithmetic matches sympy's bit for bit but sympy rounds from a 16 digit decimal, so leave anything
+    # close to a .5 tie (or too big for 15 digits) to sympy
+    distance = max_comm_range * (1 - float(sol))
+    if distance < 1e14 and abs(distance % 1 - 0.5) > max(distance, 1) * 1e-13:
+        return int(round(distance))
+
+    return int(round(max_comm_range * (1 - sol)))
+
+
 def create_comm_matrix(relay_power: int, minimum_strength: float, max_quantity: int, game_data: GameData):
     sorted_comm_list: list[tuple[str, CommPart]] = \
         sorted(game_data.comm_parts.items(), key=lambda x: (x[1].relay, x[1].power))
@@ -342,6 +377,83 @@ def create_comm_matrix(relay_power: int, minimum_strength: float, max_quantity:
     return comm_matrix
 
 
+class FleetAuditor:
+    def __init__(self, game_data: GameData, relay_body: CelestialBody, relay_power: int, minimum_strength: float):
+        self.game_data: GameData = game_data
+        self.relay_body: CelestialBody = relay_body
+        self.relay_power: int = relay_power
+        self.minimum_strength: float = minimum_strength
+
+        # Vessels with the same loadout share one power and range calculation
+        self.loadout_ranges: dict[frozenset[tuple[str, int]], tuple[int, int]] = {}
+
+    def __repr__(self):
+        return f"FleetAuditor({self.relay_body=}, {self.relay_power=}, {self.minimum_strength=}, " \
+               f"{len(self.loadout_ranges)=})"
+
+    def get_loadout_range(self, loadout: str) -> tuple[int, int]:
+        # Raises TypeError for a badly formatted loadout and KeyError for a part alias that doesn't exist.
+        # Keyed on the parsed parts so that "1:C16,2:HG5", "2:HG5,1:C16," etc share one entry
+        loadout_parts = frozenset(valid_comm_parts(loadout).items())
+
+        if loadout_parts not in self.loadout_ranges:
+            comm_parts: list[CommPart] = []
+            for alias, quantity in sorted(loadout_parts):
+                if not self.game_data.verify_comm_part(alias):
+                    raise KeyError(alias)
+
+                cp = self.game_data.get_comm_part(self.game_data.get_part_name_from_alias(alias))
+                cp.add_quantity(quantity)
+                comm_parts.append(cp)
+
+            vessel_power = calculate_combined_comm_power(comm_parts)
+            self.loadout_ranges[loadout_parts] = (vessel_power, calculate_maximum_comm_distance_cached(
+                self.relay_power, vessel_power, self.minimum_strength))
+
+        return self.loadout_ranges[loadout_parts]
+
+    def audit_vessel(self, vessel: dict) -> tuple[bool, str]:
+        if vessel["body"].lower() != self.relay_body.name.lower():
+            return False, f"orbits {vessel['body']} not {self.relay_body.name}"
+
+        loadout = vessel["comm parts"]
+        try:
+            _, comm_range = self.get_loadout_range(loadout)
+        except TypeError:
+            return False, f"comm parts \"{loadout}\" are not formatted as \"[num]:[alias]\""
+        except KeyError as e:
+            return False, f"the communication part \"{e.args[0]}\" does not exist"
+
+        # Periapsis and apoapsis are altitudes but the range is a distance, so the furthest point of the orbit is
+        # measured from the centre of the body. The positions of the relays in their own orbits aren't known here
+        furthest_distance = self.relay_body.radius + max(vessel["periapsis"], vessel["apoapsis"])
+        if furthest_distance > comm_range:
+            return False, f"orbit reaches {pretty_distance(furthest_distance, 3)} from the centre of " \
+                          f"{self.relay_body.name}, beyond the {pretty_distance(comm_range, 3)} range"
+
+        return True, f"orbit reaches {pretty_distance(furthest_distance, 3)} from the centre of " \
+                     f"{self.relay_body.name}, within the {pretty_distance(comm_range, 3)} range"
+
+
+def audit_fleet(auditor: FleetAuditor, file_path: str) -> Iterator[tuple[str, bool, str]]:
+    # The fleet export is read one vessel per line so that large fleets never have to be held in memory.
+    # Lines are decoded by json.loads so that a line that isn't valid text is reported instead of ending the audit
+    with open(file_path, "rb") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip() == b"":
+                continue
+
+            try:
+                vessel = json.loads(line)
+                name = vessel.get("name", f"Line {line_number}")
+                covered, reason = auditor.audit_vessel(vessel)
+            except (ValueError, KeyError, AttributeError, TypeError):
+                yield f"Line {line_number}", False, "could not be read as a vessel"
+                continue
+
+            yield name, covered, reason
+
+
 def create_orbit_suggestion_matrix(min_orbit: int, num_suggestions: int,
                                    target_body: CelestialBody) -> tuple[list[list[str]], bool]:
     start_orbit_period = 10800 * round(math.ceil(target_body.calculate_orbital_period(min_orbit, min_orbit)) / 10800)
@@ -402,12 +514,15 @@ examples:
   ksp_comm_array_calc.py -tb Mun -cp 2:HG5
   ksp_comm_array_calc.py -tb Gilly -cp 2:HG5,3:RA2 -ms 55%
   ksp_comm_array_calc.py -tb Sun -cp 1:HG5,5:RA15 -ms 62 -ns 7 -mq 5
+  ksp_comm_array_calc.py -tb Mun -cp 2:HG5 -fa fleet.jsonl
     """
 
     parser = argparse.ArgumentParser(epilog=help_epilog, formatter_class=argparse.RawDescriptionHelpFormatter)
 
-    parser.add_argument("-so", "--show-options", action=ShowOptions,
-                        help="show all of the body and communication options and exit")
+    parser.add_argument("-so", "--show-options", action=ShowOptions, metavar="BODY", game_data=game_data,
+                        help="show all of the body and communication options and exit. "
+                             "given a body only it and the bodies orbiting it are shown, "
+                             "otherwise only bodies starting with the given text are shown")
     parser.add_argument("-tb", "--target-body", dest="target_body", type=str, required=True,
                         help="the celestial body that the array will be orbiting")
     parser.add_argument("-cp", "--comm-parts", dest="comm_parts", type=valid_comm_parts, required=True,
@@ -420,6 +535,10 @@ examples:
                         help="the number of suggested orbits to return. default is %(default)s")
     parser.add_argument("-mq", "--max-quantity", dest="max_quantity", type=int, default=5,
                         help="the number of comm parts that will be calculated up to. default is %(default)s")
+    parser.add_argument("-fa", "--fleet-audit", dest="fleet_audit", type=str, default=None,
+                        metavar="FLEET_EXPORT",
+                        help="a fleet export with one vessel per line. instead of the usual tables, "
+                             "each vessel is checked for coverage by the array at the minimum signal strength")
 
     # ================ Main Execution ================
 
@@ -486,6 +605,29 @@ examples:
     minimum_orbit = target_body.radius
     antenna_combined_power = calculate_combined_comm_power(comm_parts)
 
+    if args.fleet_audit is not None:
+        print(f"  Combined power of all antennas on satellite: {pretty_distance(antenna_combined_power)}")
+        print()
+
+        auditor = FleetAuditor(game_data, target_body, antenna_combined_power, min_strength)
+        vessel_count = 0
+        covered_count = 0
+        try:
+            for name, covered, reason in audit_fleet(auditor, args.fleet_audit):
+                print(f"  {'PASS' if covered else 'FAIL'}  {name}: {reason}")
+                vessel_count += 1
+                covered_count += covered
+
+        except OSError:
+            print(f"The fleet export {args.fleet_audit} does not exist or cannot be read.\n")
+            exit()
+
+        print()
+        print(f"  {covered_count} of {vessel_count} vessels are covered by the array at "
+              f"{int(min_strength*100)}% signal strength")
+        print()
+        return
+
     matrix_of_comm_parts = create_comm_matrix(antenna_combined_power, min_strength, max_quantity, game_data)
 
     matrix_of_suggested_orbits, fulfilled_quota = create_orbit_suggestion_matrix(minimum_orbit, num_suggestions, target_body)
@@ -0,0 +1,354 @@
+import argparse
+import functools
+import math
+import multiprocessing
+import random
+import unittest
+from unittest import mock
+import sympy
+from typing import Callable, Optional
+from kspcac import CommPart, GameData, FleetAuditor, valid_comm_parts
+from kspcac import calculate_combined_comm_power
+from kspcac import calculate_maximum_comm_distance, calculate_maximum_comm_distance_cached
+from kspcac import calculate_signal_strength_root
+
+
+# Randomised differential tests comparing fast paths against the reference implementation in kspcac.py.
+# Run this file directly for large runs, eg: python kspcac_diff_test.py --cases 1000000 --processes 16
+
+
+EDGE_STRENGTHS = [0.0, 0.01, 0.02, 0.98, 0.99]
+
+
+def random_comm_part(rng: random.Random, index: int) -> CommPart:
+    combinable = rng.random() < 0.9
+    part_data = {"alias": f"P{index}", "power": int(10 ** rng.uniform(3.5, 11.5)), "combinable": combinable,
+                 "combinability exponent": rng.choice([0.75, 1, rng.uniform(0.5, 1)]) if combinable else 0,
+                 "relay": rng.random() < 0.5}
+
+    return CommPart(f"Random Part {index}", part_data)
+
+
+def random_loadout(rng: random.Random) -> list[CommPart]:
+    loadout = []
+    for index in range(rng.randint(1, 4)):
+        part = random_comm_part(rng, index)
+        part.add_quantity(rng.randint(1, 10) if part.combinable else 1)
+        loadout.append(part)
+
+    return loadout
+
+
+def random_strength(rng: random.Random) -> float:
+    # Same values valid_percent can produce, with extra weight on the ends of the range
+    if rng.random() < 0.2:
+        return rng.choice(EDGE_STRENGTHS)
+
+    return rng.randint(0, 99) / 100
+
+
+def random_comm_distance_case(rng: random.Random) -> tuple:
+    return (calculate_combined_comm_power(random_loadout(rng)),
+            calculate_combined_comm_power(random_loadout(rng)),
+            random_strength(rng))
+
+
+# Roots of the cubic calculate_maximum_comm_distance solves, None where the reference fails
+REFERENCE_ROOTS: dict[float, Optional[sympy.Float]] = {}
+
+
+def reference_root(minimum_strength: float) -> sympy.Float:
+    if minimum_strength not in REFERENCE_ROOTS:
+        # The same lines as calculate_maximum_comm_distance
+        x = sympy.symbols("x")
+        eq = sympy.Eq(-2*x**3 + 3*x**2, minimum_strength)
+        try:
+            REFERENCE_ROOTS[minimum_strength] = sympy.solve(eq, x)[1].args[0]
+        except IndexError:
+            REFERENCE_ROOTS[minimum_strength] = None
+
+    if REFERENCE_ROOTS[minimum_strength] is None:
+        raise IndexError(f"the reference has no root for {minimum_strength}")
+
+    return REFERENCE_ROOTS[minimum_strength]
+
+
+def reference_comm_distance(comm_power_1: int, comm_power_2: int, minimum_strength: float) -> int:
+    # calculate_maximum_comm_distance without building and solving the cubic for every case.
+    # TestReferenceCommDistance checks that the two agree
+    max_comm_range = math.sqrt(comm_power_1 * comm_power_2)
+
+    return int(round(max_comm_range * (1 - reference_root(minimum_strength))))
+
+
+def precompute_roots():
+    # Solve the cubic once per strength valid_percent can produce, for the reference and for the cached fast path
+    for percent in range(0, 101):
+        calculate_signal_strength_root(percent / 100)
+        try:
+            reference_root(percent / 100)
+        except IndexError:
+            pass
+
+
+LOADOUT_GAME_DATA = GameData({
+    "bodies": {"Test": {"radius": 200000, "mass": 975990660000000000000, "sphere of influence": 0, "parent body": ""}},
+    "communication parts": {part.full_name: {"alias": part.alias, "power": part.power, "combinable": part.combinable,
+                                             "combinability exponent": part.combinability_exponent,
+                                             "relay": part.relay}
+                            for part in (random_comm_part(random.Random(f"loadout part {index}"), index)
+                                         for index in range(10))}})
+
+# A few relay powers so that the auditors' caches are hit, one auditor per relay power and strength
+LOADOUT_RELAY_POWERS = [5000000, 8408964, 2000000000, 100_000_000_000]
+LOADOUT_AUDITORS: dict[tuple[int, float], FleetAuditor] = {}
+
+
+def random_loadout_case(rng: random.Random) -> tuple:
+    # Small quantities, shuffled parts and trailing commas so that the same loadout is often written differently
+    aliases = rng.sample([part.alias for part in LOADOUT_GAME_DATA.comm_parts.values()], rng.randint(1, 4))
+    loadout = ",".join(f"{rng.randint(1, 3)}:{alias}" for alias in aliases) + ("," if rng.random() < 0.2 else "")
+
+    return rng.choice(LOADOUT_RELAY_POWERS), random_strength(rng), loadout
+
+
+def loadout_comm_parts(loadout: str) -> list[CommPart]:
+    comm_parts = []
+    for alias, quantity in valid_comm_parts(loadout).items():
+        cp = LOADOUT_GAME_DATA.get_comm_part(LOADOUT_GAME_DATA.get_part_name_from_alias(alias))
+        cp.add_quantity(quantity)
+        comm_parts.append(cp)
+
+    return comm_parts
+
+
+def reference_loadout_range(relay_power: int, minimum_strength: float, loadout: str) -> tuple[int, int]:
+    # The parts are combined in the order they were written
+    vessel_power = calculate_combined_comm_power(loadout_comm_parts(loadout))
+
+    return vessel_power, reference_comm_distance(relay_power, vessel_power, minimum_strength)
+
+
+def cached_loadout_range(relay_power: int, minimum_strength: float, loadout: str) -> tuple[int, int]:
+    if (relay_power, minimum_strength) not in LOADOUT_AUDITORS:
+        LOADOUT_AUDITORS[(relay_power, minimum_strength)] = FleetAuditor(
+            LOADOUT_GAME_DATA, LOADOUT_GAME_DATA.get_celestial_body("Test"), relay_power, minimum_strength)
+
+    return LOADOUT_AUDITORS[(relay_power, minimum_strength)].get_loadout_range(loadout)
+
+
+# The reference fails at these strengths, 0% reaches the full range and 50% reaches half of it
+ANALYTIC_ROOTS = {0.0: 0, 0.5: 0.5}
+
+
+def analytic_comm_distance(comm_power_1: int, comm_power_2: int, minimum_strength: float) -> Optional[int]:
+    if minimum_strength not in ANALYTIC_ROOTS:
+        return None
+
+    # Rounded with sympy like the reference would have been
+    max_comm_range = math.sqrt(comm_power_1 * comm_power_2)
+    return int(round(max_comm_range * (1 - sympy.Float(ANALYTIC_ROOTS[minimum_strength]))))
+
+
+def analytic_loadout_range(relay_power: int, minimum_strength: float, loadout: str) -> Optional[tuple[int, int]]:
+    vessel_power = calculate_combined_comm_power(loadout_comm_parts(loadout))
+    comm_range = analytic_comm_distance(relay_power, vessel_power, minimum_strength)
+
+    return None if comm_range is None else (vessel_power, comm_range)
+
+
+# engine name: (reference, candidate, case generator, analytic answer for the cases the reference can't answer)
+ENGINE_PAIRS: dict[str, tuple[Callable, Callable, Callable[[random.Random], tuple], Callable]] = {
+    "cached comm distance": (reference_comm_distance, calculate_maximum_comm_distance_cached,
+                             random_comm_distance_case, analytic_comm_distance),
+    "fleet audit loadout cache": (reference_loadout_range, cached_loadout_range,
+                                  random_loadout_case, analytic_loadout_range),
+}
+
+
+class DivergenceReport:
+    def __init__(self, engine: str):
+        self.engine: str = engine
+
+        self.cases: int = 0
+        self.mismatches: int = 0
+        self.reference_errors: int = 0
+        self.worst_divergence: int = 0
+        self.worst_case: Optional[tuple] = None
+
+        # Cases where the reference failed with no analytic answer but the candidate still returned something
+        self.unverified: int = 0
+        self.unverified_case: Optional[tuple] = None
+
+    def __repr__(self):
+        return f"DivergenceReport({self.engine=}, {self.cases=}, {self.mismatches=}, " \
+               f"{self.reference_errors=}, {self.worst_divergence=}, {self.worst_case=}, " \
+               f"{self.unverified=}, {self.unverified_case=})"
+
+    def record(self, case: tuple, reference_result, candidate_result):
+        # Results are either a single int or a tuple of ints, the divergence is the largest difference in them
+        if not isinstance(reference_result, tuple):
+            reference_result, candidate_result = (reference_result,), (candidate_result,)
+
+        self.cases += 1
+        divergence = max(abs(r - c) for r, c in zip(reference_result, candidate_result))
+
+        if divergence == 0:
+            return
+
+        self.mismatches += 1
+        if divergence > self.worst_divergence:
+            self.worst_divergence = divergence
+            self.worst_case = case
+
+    def merge(self, other: "DivergenceReport"):
+        self.cases += other.cases
+        self.mismatches += other.mismatches
+        self.reference_errors += other.reference_errors
+        self.unverified += other.unverified
+
+        if self.unverified_case is None:
+            self.unverified_case = other.unverified_case
+
+        if other.worst_divergence > self.worst_divergence:
+            self.worst_divergence = other.worst_divergence
+            self.worst_case = other.worst_case
+
+
+def compare_case(engine: str, case: tuple, report: DivergenceReport):
+    reference, candidate, _, analytic = ENGINE_PAIRS[engine]
+
+    try:
+        reference_result = reference(*case)
+    except Exception:
+        # The reference has no answer for some inputs (eg sympy returns the roots in a different form at 0% and 50%)
+        report.reference_errors += 1
+        reference_result = analytic(*case)
+
+        if reference_result is None:
+            try:
+                candidate(*case)
+            except Exception:
+                return
+
+            report.unverified += 1
+            report.unverified_case = report.unverified_case or case
+            return
+
+    report.record(case, reference_result, candidate(*case))
+
+
+def run_chunk(chunk: tuple[str, str, int]) -> DivergenceReport:
+    engine, seed, num_cases = chunk
+    generator = ENGINE_PAIRS[engine][2]
+    rng = random.Random(seed)
+
+    report = DivergenceReport(engine)
+    for _ in range(num_cases):
+        compare_case(engine, generator(rng), report)
+
+    return report
+
+
+def run_differential(engine: str, num_cases: int, seed: int = 0,
+                     processes: Optional[int] = None, chunk_size: int = 1000) -> DivergenceReport:
+    chunks = [(engine, f"{seed}:{index}", min(chunk_size, num_cases - start))
+              for index, start in enumerate(range(0, num_cases, chunk_size))]
+
+    report = DivergenceReport(engine)
+    with multiprocessing.Pool(processes, initializer=precompute_roots) as pool:
+        for chunk_report in pool.imap_unordered(run_chunk, chunks):
+            report.merge(chunk_report)
+
+    return report
+
+
+class TestReferenceCommDistance(unittest.TestCase):
+    def test_matches_reference(self):
+        with mock.patch("sympy.solve", functools.lru_cache(maxsize=None)(sympy.solve)):
+            for power_1, power_2 in [(8408964, 500000), (126138417111, 640409284403)]:
+                for percent in range(0, 101):
+                    try:
+                        expected = calculate_maximum_comm_distance(power_1, power_2, percent / 100)
+                    except IndexError:
+                        with self.assertRaises(IndexError):
+                            reference_comm_distance(power_1, power_2, percent / 100)
+                        continue
+
+                    self.assertEqual(expected, reference_comm_distance(power_1, power_2, percent / 100))
+
+
+class TestCachedCommDistance(unittest.TestCase):
+    def test_every_strength(self):
+        report = DivergenceReport("cached comm distance")
+        for power_1, power_2 in [(5000000, 500000), (8408964, 500000), (100_000_000_000, 100_000_000_000)]:
+            for percent in range(0, 100):
+                compare_case("cached comm distance", (power_1, power_2, percent / 100), report)
+
+        self.assertEqual(300, report.cases)
+        self.assertEqual(0, report.mismatches, report)
+
+    def test_analytic_strengths(self):
+        self.assertEqual(2050483, analytic_comm_distance(8408964, 500000, 0.0))
+        self.assertEqual(1025242, analytic_comm_distance(8408964, 500000, 0.5))
+        self.assertIsNone(analytic_comm_distance(8408964, 500000, 0.8))
+
+    def test_rounding_ties(self):
+        # sympy rounds 149695670143.49985 up, plain float rounding would give 149695670143
+        report = DivergenceReport("cached comm distance")
+        compare_case("cached comm distance", (126138417111, 640409284403, 0.46), report)
+
+        self.assertEqual(1, report.cases)
+        self.assertEqual(0, report.mismatches, report)
+        self.assertEqual(149695670144, calculate_maximum_comm_distance(126138417111, 640409284403, 0.46))
+
+    def test_random_cases(self):
+        report = run_differential("cached comm distance", 2000, chunk_size=250)
+
+        self.assertEqual(2000, report.cases)
+        self.assertEqual(0, report.mismatches, report)
+        self.assertEqual(0, report.unverified, report)
+
+
+class TestFleetAuditLoadoutCache(unittest.TestCase):
+    def test_random_cases(self):
+        report = run_differential("fleet audit loadout cache", 2000, chunk_size=500)
+
+        self.assertEqual(2000, report.cases)
+        self.assertEqual(0, report.mismatches, report)
+        self.assertEqual(0, report.unverified, report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare the fast paths in kspcac.py against the reference code")
+    parser.add_argument("-e", "--engine", dest="engines", action="append", choices=list(ENGINE_PAIRS),
+                        help="the engine to check, can be repeated. default is all of them")
+    parser.add_argument("-c", "--cases", dest="cases", type=int, default=100_000,
+                        help="the number of random cases to check for each engine. default is %(default)s")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=0,
+                        help="the seed for the random cases. default is %(default)s")
+    parser.add_argument("-p", "--processes", dest="processes", type=int, default=None,
+                        help="the number of worker processes. default is one per cpu")
+
+    args = parser.parse_args()
+
+    failed = False
+    for engine in args.engines or ENGINE_PAIRS:
+        report = run_differential(engine, args.cases, args.seed, args.processes)
+        failed = failed or report.mismatches > 0 or report.unverified > 0
+
+        print(f"{engine}:")
+        print(f"  Cases compared: {report.cases}")
+        print(f"  Cases the reference could not answer: {report.reference_errors}"
+              f" (compared against the analytic answer where there is one)")
+        print(f"  Cases only the candidate could answer: {report.unverified}" +
+              (f", eg {report.unverified_case}" if report.unverified_case is not None else ""))
+        print(f"  Mismatches: {report.mismatches}")
+        print(f"  Worst-case divergence: {report.worst_divergence}" +
+              (f" for {report.worst_case}" if report.worst_case is not None else ""))
+
+    exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
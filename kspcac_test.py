@@ -1,9 +1,13 @@
+import json
+import os
+import tempfile
 import unittest
 from kspcac import CelestialBody, CommPart
 from kspcac import valid_percent, valid_comm_parts
-from kspcac import read_game_data, GAME_DATA_FILE_PATH
+from kspcac import read_game_data, GAME_DATA_FILE_PATH, system_hierarchy_rows
 from kspcac import pretty_distance, pretty_time, pretty_speed
 from kspcac import calculate_combined_comm_power, calculate_maximum_comm_distance
+from kspcac import FleetAuditor, audit_fleet
 
 
 # TODO Make these tests use hard coded values instead of reading from the json file
@@ -81,6 +85,38 @@ class TestGameData(unittest.TestCase):
     def test_get_part_name_from_alias(self):
         pass
 
+    def test_get_body_children(self):
+        game_data = read_game_data(GAME_DATA_FILE_PATH)
+        body_children = game_data.get_body_children()
+
+        self.assertEqual(["Sun"], body_children[""])
+        self.assertEqual(["Bop", "Laythe", "Pol", "Tylo", "Vall"], body_children["Jool"])
+        self.assertNotIn("Mun", body_children)
+
+
+class TestSystemHierarchyRows(unittest.TestCase):
+    def test_full_system(self):
+        game_data = read_game_data(GAME_DATA_FILE_PATH)
+
+        self.assertEqual(["  Sun", "    Dres", "    Duna", "      Ike", "    Eeloo", "    Eve", "      Gilly",
+                          "    Jool", "      Bop", "      Laythe", "      Pol", "      Tylo", "      Vall",
+                          "    Kerbin", "      Minmus", "      Mun", "    Moho"],
+                         list(system_hierarchy_rows(game_data)))
+
+    def test_subtree(self):
+        game_data = read_game_data(GAME_DATA_FILE_PATH)
+
+        self.assertEqual(["  Kerbin", "    Minmus", "    Mun"], list(system_hierarchy_rows(game_data, "Kerbin")))
+        self.assertEqual(["  Mun"], list(system_hierarchy_rows(game_data, "Mun")))
+
+    def test_name_prefix(self):
+        game_data = read_game_data(GAME_DATA_FILE_PATH)
+
+        self.assertEqual(["      Minmus", "      Mun", "    Moho"],
+                         list(system_hierarchy_rows(game_data, name_prefix="m")))
+        self.assertEqual(["    Duna"], list(system_hierarchy_rows(game_data, name_prefix="Du")))
+        self.assertEqual([], list(system_hierarchy_rows(game_data, name_prefix="space")))
+
 
 class TestCelestialBody(unittest.TestCase):
     def test_calculate_orbital_period(self):
@@ -191,6 +227,73 @@ class TestCommunicationCalculators(unittest.TestCase):
         self.assertEqual(588777, calculate_maximum_comm_distance(8408964, 500000, 0.8))
 
 
+class TestFleetAudit(unittest.TestCase):
+    def setUp(self):
+        game_data = read_game_data(GAME_DATA_FILE_PATH)
+        self.auditor = FleetAuditor(game_data, game_data.get_celestial_body("Mun"), 8408964, 0.8)
+
+    def test_get_loadout_range(self):
+        self.assertEqual((500000, 588777), self.auditor.get_loadout_range("1:C16"))
+        self.assertEqual((500000, 588777), self.auditor.get_loadout_range("1:C16,"))
+        self.assertEqual(1, len(self.auditor.loadout_ranges))
+
+        self.assertEqual(self.auditor.get_loadout_range("1:C16,2:HG5"), self.auditor.get_loadout_range("2:HG5,1:C16"))
+        self.assertEqual(2, len(self.auditor.loadout_ranges))
+
+        with self.assertRaises(TypeError):
+            self.auditor.get_loadout_range("C16")
+        with self.assertRaises(KeyError):
+            self.auditor.get_loadout_range("1:XX9")
+
+    def test_get_loadout_range_edge_strengths(self):
+        game_data = read_game_data(GAME_DATA_FILE_PATH)
+        mun = game_data.get_celestial_body("Mun")
+
+        # 0% reaches the full sqrt(8408964 * 500000) range and 50% reaches half of it
+        self.assertEqual((500000, 2050483), FleetAuditor(game_data, mun, 8408964, 0.0).get_loadout_range("1:C16"))
+        self.assertEqual((500000, 1025242), FleetAuditor(game_data, mun, 8408964, 0.5).get_loadout_range("1:C16"))
+
+        self.assertEqual((500000, calculate_maximum_comm_distance(8408964, 500000, 0.99)),
+                         FleetAuditor(game_data, mun, 8408964, 0.99).get_loadout_range("1:C16"))
+
+    def test_audit_vessel(self):
+        # Passes while the Mun's 200 km radius plus the higher of periapsis and apoapsis is within the 588.777 km range
+        vessel = {"name": "Lander", "body": "mun", "periapsis": 20000, "apoapsis": 388777, "comm parts": "1:C16"}
+        self.assertEqual((True, "orbit reaches 588.777 km from the centre of Mun, within the 588.777 km range"),
+                         self.auditor.audit_vessel(vessel))
+
+        vessel["apoapsis"] = 388778
+        self.assertFalse(self.auditor.audit_vessel(vessel)[0])
+
+        vessel["periapsis"], vessel["apoapsis"] = 388778, 20000
+        self.assertFalse(self.auditor.audit_vessel(vessel)[0])
+
+        vessel["body"] = "Minmus"
+        self.assertEqual((False, "orbits Minmus not Mun"), self.auditor.audit_vessel(vessel))
+
+        vessel["body"] = "Mun"
+        vessel["comm parts"] = "1:XX9"
+        self.assertEqual((False, "the communication part \"XX9\" does not exist"), self.auditor.audit_vessel(vessel))
+
+    def test_audit_fleet(self):
+        vessels = [{"name": "Lander", "body": "Mun", "periapsis": 20000, "apoapsis": 40000, "comm parts": "1:C16"},
+                   {"name": "Probe", "body": "Mun", "periapsis": 20000, "apoapsis": 900000, "comm parts": "1:C16"},
+                   {"name": "Rover", "body": "Mun"}]
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.write("\n".join(json.dumps(vessel) for vessel in vessels) + "\n\nnot json\n")
+        with open(f.name, "ab") as f:
+            f.write(b"\xff\xfe\x00\xd8garbage\x80\n")
+        try:
+            results = list(audit_fleet(self.auditor, f.name))
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual([("Lander", True), ("Probe", False), ("Line 3", False), ("Line 5", False),
+                          ("Line 6", False)],
+                         [(name, covered) for name, covered, _ in results])
+
+
 class FullArgumentPassingFailureTests(unittest.TestCase):
     def test_valid_percent(self):
         pass